@@ -13,32 +13,40 @@
 #    limitations under the License.
 
 import os
+import re
 import sys
+import time
 import logging
+import json
+import hashlib
+import hmac
+import socket
+import asyncio
+import argparse
+import importlib
+import urllib.parse
 from logging import handlers
-from typing import List, Tuple, Optional
+from typing import Any, Callable, Dict, List, Tuple, Optional
+from collections import OrderedDict
 from dataclasses import asdict, dataclass
-from dataclasses_json import dataclass_json, LetterCase
 
 from aiohttp.web import View, Application, run_app
 from aiohttp import web
-import markdown
 from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
-import pymdownx.emoji
 
 import files
-import pictures
-import search
 import appconf
+import watcher
+import links
 
+# Note: modules with heavy dependencies (markdown, pictures, search) are imported
+# on first use and pre-warmed in background once the server is running (see prewarm()).
+DEFERRED_MODULES = ('markdown', 'pymdownx.emoji', 'pictures', 'search')
 
-if 'RIKI_CONF_PATH' in os.environ:
-    conf_path = os.environ['RIKI_CONF_PATH']
-else:
-    conf_path = os.path.realpath(os.path.join(os.path.dirname(__file__), 'config.json'))
-conf = appconf.load_conf(conf_path)
-APP_NAME = conf.app_name
-APP_PATH = conf.app_path
+
+conf: Optional[appconf.Conf] = None
+APP_NAME: Optional[str] = None
+APP_PATH: Optional[str] = None
 
 logger = logging.getLogger('')
 
@@ -62,23 +70,46 @@ def setup_logger(path, debug=False):
     logger.setLevel(logging.INFO if not debug else logging.DEBUG)
 
 
-setup_logger(str(conf.log_path))
-logging.getLogger(__name__).info(f'using Riki configuration {conf_path}')
+def get_conf_path() -> str:
+    if 'RIKI_CONF_PATH' in os.environ:
+        return os.environ['RIKI_CONF_PATH']
+    return os.path.realpath(os.path.join(os.path.dirname(__file__), 'config.json'))
 
 
-markdown_config = {
-    'pymdownx.emoji': {
-        'emoji_index': pymdownx.emoji.twemoji,
-        'emoji_generator': pymdownx.emoji.to_svg,
-        'options': {
-            'image_path': conf.emoji_cdn_url
+def init_conf(conf_path: str):
+    """
+    Loads the configuration and sets-up logging. This must be called
+    before the application starts (factory() and setup_runtime() ensure that).
+    """
+    global conf, APP_NAME, APP_PATH
+    conf = appconf.load_conf(conf_path)
+    APP_NAME = conf.app_name
+    APP_PATH = conf.app_path
+    setup_logger(str(conf.log_path))
+    logging.getLogger(__name__).info(f'using Riki configuration {conf_path}')
+
+
+_markdown_config = None
+
+
+def get_markdown_config():
+    global _markdown_config
+    if _markdown_config is None:
+        import pymdownx.emoji
+        _markdown_config = {
+            'pymdownx.emoji': {
+                'emoji_index': pymdownx.emoji.twemoji,
+                'emoji_generator': pymdownx.emoji.to_svg,
+                'options': {
+                    'image_path': conf.emoji_cdn_url
+                }
+            },
+            'pymdownx.arithmatex': {
+                'generic': True,
+                'preview': False
+            }
         }
-    },
-    'pymdownx.arithmatex': {
-        'generic': True,
-        'preview': False
-    }
-}
+    return _markdown_config
 
 
 def path_dir_elms(path: str) -> List[Tuple[str, str]]:
@@ -102,16 +133,41 @@ def load_markdown(path: str) -> str:
     a string containing output HTML
     """
     with open(path) as page_file:
-        return markdown.markdown(
-            page_file.read(),
-            extensions=conf.markdown_extensions,
-            extension_configs=markdown_config)
+        return render_markdown(page_file.read())
+
+
+def render_markdown(text: str) -> str:
+    import markdown
+    return markdown.markdown(
+        text,
+        extensions=conf.markdown_extensions,
+        extension_configs=get_markdown_config())
+
+
+def prewarm() -> List[Tuple[str, float]]:
+    """
+    Imports modules which are not required for the server to start
+    and initializes the Markdown processor with all the configured extensions.
+
+    returns:
+    a list of (step description, time in seconds)
+    """
+    ans = []
+    for module in DEFERRED_MODULES:
+        t0 = time.perf_counter()
+        importlib.import_module(module)
+        ans.append((f'import {module}', time.perf_counter() - t0))
+    t0 = time.perf_counter()
+    render_markdown('# Riki\n\n:smile: $x$')
+    ans.append(('first Markdown rendering', time.perf_counter() - t0))
+    return ans
 
 
 routes = web.RouteTableDef()
 
+_PAGE_LINK = re.compile(r'<a class="page" href="[^"]*">(.*?)</a>', re.DOTALL)
+
 
-@dataclass_json(letter_case=LetterCase.CAMEL)
 @dataclass
 class DirMetadata:
 
@@ -131,15 +187,99 @@ class ActionHelper:
             bytecode_cache=self._cache,
             trim_blocks=True,
             lstrip_blocks=True)
-
-    def response_html(self, template, data):
+        self._link_graph = links.LinkGraph(
+            links.LinkGraph.graph_path(conf.search_index_dir)).load() if conf.search_index_dir else None
+        self._fragments: OrderedDict = OrderedDict()
+        self._fragment_cache_size = conf.fragment_cache_size
+
+    def precompile_templates(self) -> int:
+        """
+        Loads and compiles all the templates so the first requests
+        do not have to.
+
+        returns:
+        number of compiled templates
+        """
+        names = self._template_env.list_templates(extensions=['html'])
+        for name in names:
+            self._template_env.get_template(name)
+        return len(names)
+
+    def _template_values(self, data):
         values = dict(
             app_name=APP_NAME,
             app_path=APP_PATH,
             enable_search=True) # TODO
         values.update(data)
+        return values
+
+    def response_html(self, template, data):
         template_object = self._template_env.get_template(template)
-        return web.Response(text=template_object.render(values), content_type='text/html')
+        return web.Response(text=template_object.render(self._template_values(data)), content_type='text/html')
+
+    async def response_html_stream(self, request: web.Request, template, data, chunk_size=1 << 14):
+        """
+        Renders a template incrementally (via Jinja's generate()) and sends the output
+        as a chunked response. This is intended for pages with possibly large listings
+        where the data can be passed as lazy iterators (see files.iter_files).
+
+        arguments:
+        request -- the request we respond to
+        template -- a template name
+        data -- template data
+        chunk_size -- min. size of a chunk (in characters) sent to the client
+        """
+        template_object = self._template_env.get_template(template)
+        resp = web.StreamResponse()
+        resp.content_type = 'text/html'
+        resp.charset = 'utf-8'
+        await resp.prepare(request)
+        buff = []
+        buff_size = 0
+        for chunk in template_object.generate(self._template_values(data)):
+            buff.append(chunk)
+            buff_size += len(chunk)
+            if buff_size >= chunk_size:
+                await resp.write(''.join(buff).encode('utf-8'))
+                buff = []
+                buff_size = 0
+        if buff:
+            await resp.write(''.join(buff).encode('utf-8'))
+        await resp.write_eof()
+        return resp
+
+    def render_blocks(self, template, data, blocks) -> Dict[str, str]:
+        """
+        Renders selected blocks of a template (e.g. just the 'content' of a page
+        without the surrounding layout).
+
+        returns:
+        a dictionary block name -> rendered HTML (empty if the template does not define the block)
+        """
+        template_object = self._template_env.get_template(template)
+        ctx = template_object.new_context(self._template_values(data))
+        return dict(
+            (block, ''.join(template_object.blocks[block](ctx)) if block in template_object.blocks else '')
+            for block in blocks)
+
+    def render_fragment(self, template, data) -> str:
+        return self._template_env.get_template(template).render(self._template_values(data))
+
+    def cached_fragment(self, key: Tuple, fn: Callable[[], Any]):
+        """
+        Returns a cached value (typically a rendered HTML fragment) or creates
+        it via fn. Keys are tuples (kind, directory path, ...) - the directory
+        path is used to invalidate entries (see invalidate()). Anything the value
+        depends on (e.g. directory mtime) must be the part of the key.
+        """
+        if key in self._fragments:
+            self._fragments.move_to_end(key)
+            return self._fragments[key]
+        ans = fn()
+        self._fragments[key] = ans
+        if len(self._fragments) > self._fragment_cache_size:
+            self._fragments.popitem(last=False)
+        return ans
 
     def response_file(self, path: str):
         return web.FileResponse(path)
@@ -155,11 +295,31 @@ class ActionHelper:
         if dir_path not in self._dir_metadata:
             try:
                 with open(os.path.join(dir_path, 'metadata.json'), 'rb') as fr:
-                    self._dir_metadata[dir_path] = DirMetadata.from_json(fr.read())
+                    self._dir_metadata[dir_path] = appconf.from_camel_case_dict(DirMetadata, json.load(fr))
             except IOError:
                 self._dir_metadata[dir_path] = DirMetadata()
         return self._dir_metadata[dir_path]
 
+    def link_graph(self) -> Optional[links.LinkGraph]:
+        """
+        Returns the graph of links between pages (reloaded in case the search
+        indexer has updated it) or None if there is no search index configured.
+        """
+        return self._link_graph.reload_if_changed() if self._link_graph else None
+
+    def invalidate(self, fs_path: str):
+        """
+        Removes cached data depending on a changed path (see watcher.ChangeNotifier)
+        """
+        for dir_path in list(self._dir_metadata.keys()):
+            norm_dir_path = os.path.normpath(dir_path)
+            if (norm_dir_path == fs_path or norm_dir_path == os.path.dirname(fs_path)
+                    or norm_dir_path.startswith(fs_path + os.sep)):
+                del self._dir_metadata[dir_path]
+        for key in list(self._fragments.keys()):
+            if key[1] == fs_path or key[1] == os.path.dirname(fs_path) or key[1].startswith(fs_path + os.sep):
+                del self._fragments[key]
+
 
 class BaseAction(View):
 
@@ -170,6 +330,9 @@ class BaseAction(View):
     def response_html(self, template, data):
         return self._ctx.response_html(template, data)
 
+    async def response_html_stream(self, template, data):
+        return await self._ctx.response_html_stream(self.request, template, data)
+
     def response_file(self, path: bytes):
         return self._ctx.response_file(path)
 
@@ -202,6 +365,47 @@ class Action(BaseAction):
                 os.path.isdir(x)
             ) for x in page_list]
 
+    def get_page_list(self, curr_dir_fs: str, page_name: str) -> Tuple[list, str]:
+        """
+        Returns a directory listing along with its rendered HTML. Both
+        are cached (the key contains the directory mtime which changes
+        whenever an item is added, removed or renamed). A missing
+        directory produces HTTP 404.
+
+        arguments:
+        curr_dir_fs -- a normalized filesystem path of the directory
+        page_name -- a name of the current page (highlighted in the HTML)
+
+        returns:
+        a 2-tuple (page list, page list HTML)
+        """
+        try:
+            mtime = os.stat(curr_dir_fs).st_mtime_ns
+        except FileNotFoundError:
+            raise web.HTTPNotFound()
+        page_list = self._ctx.cached_fragment(
+            ('page_list', curr_dir_fs, mtime), lambda: self.generate_page_list(curr_dir_fs))
+        page_list_html = self._ctx.cached_fragment(
+            ('page_list_html', curr_dir_fs, mtime),
+            lambda: self._ctx.render_fragment('_page_list.html', dict(page_list=page_list, page_name=None)))
+        return page_list, self.mark_current_page(page_list_html, page_name)
+
+    @staticmethod
+    def mark_current_page(page_list_html: str, page_name: str) -> str:
+        """
+        Replaces the link of the current page in a rendered directory
+        listing (see _page_list.html) by a highlighted label. This way
+        the listing can be rendered just once for all the pages of the
+        directory.
+        """
+        idx = page_list_html.find(f' data-name="{page_name}"')
+        if idx < 0:
+            return page_list_html
+        start = page_list_html.rfind('<li ', 0, idx)
+        end = page_list_html.find('</li>', idx)
+        item_html = _PAGE_LINK.sub(r'<span class="page current">\1</span>', page_list_html[start:end], count=1)
+        return page_list_html[:start] + item_html + page_list_html[end:]
+
     @property
     def dir_metadata(self) -> DirMetadata:
         return self._ctx.dir_metadata(os.path.join(self.data_dir, self.riki_path))
@@ -237,6 +441,7 @@ class Picture(Action):
     """
 
     async def get(self):
+        import pictures
         fs_path = os.path.join(self.data_dir, self.riki_path)
         width = self.request.rel_url.query.get('width')
         normalize = bool(int(self.request.rel_url.query.get('normalize', '0')))
@@ -254,29 +459,21 @@ class Page(Action):
     """
     A riki page
     """
-    async def get(self):
-        if not self.riki_path:
-            raise web.HTTPSeeOther(f'{APP_PATH}page/index')
 
-        page_fs_path = os.path.join(self.data_dir, self.riki_path)
-        pelms = page_fs_path.rsplit('.', 1)
-        page_suff = None if len(pelms) < 2 else pelms[-1]
+    def get_page_data(self, page_fs_path: str, include_list: bool) -> Tuple[str, dict]:
+        """
+        Transforms a Markdown page and collects all the data needed to render it.
 
-        if self.dir_metadata.directory_type == 'gallery':
-                raise web.HTTPSeeOther(f'{APP_PATH}gallery/{self.riki_path}/index')
-        elif files.page_is_dir(page_fs_path):
-            if self.dir_metadata.directory_type == 'page':
-                raise web.HTTPSeeOther(f'{APP_PATH}page/{self.riki_path}/index')
-            else:
-                raise web.HTTPServerError('Unknown page type')
-        elif page_suff and page_suff in appconf.RAW_FILES:
-            with open(page_fs_path, 'rb') as fr:
-                web.header('Content-Type', appconf.RAW_FILES[page_suff])
-                return fr.read()
-        else:
-            page_fs_path = f'{page_fs_path}.md'
-            curr_dir = os.path.dirname(self.riki_path)
-            page_name = os.path.basename(self.riki_path)
+        arguments:
+        page_fs_path -- a filesystem path of the page (including the .md suffix)
+        include_list -- if False then the directory listing is generated only if
+                        the page does not exist (i.e. the listing is the page itself)
+
+        returns:
+        a 2-tuple (template name, template data)
+        """
+        curr_dir = os.path.dirname(self.riki_path)
+        page_name = os.path.basename(self.riki_path)
 
         # setup the directory information
         if curr_dir:
@@ -286,6 +483,7 @@ class Page(Action):
             curr_dir = ''
             path_elms = []
             curr_dir_fs = self.data_dir
+        curr_dir_fs = os.path.normpath(curr_dir_fs)
 
         # transform the page
         if files.page_exists(page_fs_path):
@@ -297,17 +495,99 @@ class Page(Action):
             inner_html = ''
             page_info = files.RevisionInfo()
             page_template = 'dummy_page.html'
+            include_list = True
 
+        page_list, page_list_html = self.get_page_list(curr_dir_fs, page_name) if include_list else (None, None)
+        path_html = self._ctx.cached_fragment(
+            ('path', curr_dir_fs, page_name),
+            lambda: self._ctx.render_fragment('_path.html', dict(path_elms=path_elms, page_name=page_name)))
+        link_graph = self._ctx.link_graph()
         data = dict(
             html=inner_html,
-            page_list=self.generate_page_list(curr_dir_fs),
+            page_list=page_list,
+            page_list_html=page_list_html,
             path_elms=path_elms,
+            path_html=path_html,
             page_info=page_info,
+            backlinks=link_graph.backlinks(links.page_id(self.riki_path)) if link_graph else [],
             page_name=page_name,
             curr_dir_name=self.get_current_dirname(curr_dir))
+        return page_template, data
+
+    async def get(self):
+        if not self.riki_path:
+            raise web.HTTPSeeOther(f'{APP_PATH}page/index')
+
+        page_fs_path = os.path.join(self.data_dir, self.riki_path)
+        pelms = page_fs_path.rsplit('.', 1)
+        page_suff = None if len(pelms) < 2 else pelms[-1]
+
+        if self.dir_metadata.directory_type == 'gallery':
+                raise web.HTTPSeeOther(f'{APP_PATH}gallery/{self.riki_path}/index')
+        elif files.page_is_dir(page_fs_path):
+            if self.dir_metadata.directory_type == 'page':
+                raise web.HTTPSeeOther(f'{APP_PATH}page/{self.riki_path}/index')
+            else:
+                raise web.HTTPServerError('Unknown page type')
+        elif page_suff and page_suff in appconf.RAW_FILES:
+            with open(page_fs_path, 'rb') as fr:
+                web.header('Content-Type', appconf.RAW_FILES[page_suff])
+                return fr.read()
+
+        page_template, data = self.get_page_data(f'{page_fs_path}.md', include_list=True)
         return self.response_html(page_template, data)
 
 
+@routes.view('/_page/{path:.*}')
+class PageFragment(Page):
+    """
+    A riki page without the surrounding layout, encoded as JSON. This is used
+    by the client-side navigation.
+
+    URL arguments:
+    list -- if 1 then also the listing of the page's directory is included
+    """
+
+    def page_etag(self, page_fs_path: str, include_list: bool) -> str:
+        link_graph = self._ctx.link_graph()
+        parts = [self.riki_path, str(include_list), str(link_graph.mtime if link_graph else None)]
+        stat_paths = [page_fs_path]
+        if include_list or not files.page_exists(page_fs_path):
+            stat_paths.append(os.path.dirname(page_fs_path))
+        for path in stat_paths:
+            try:
+                st = os.stat(path)
+                parts.append(f'{st.st_mtime_ns}-{st.st_size}')
+            except FileNotFoundError:
+                parts.append('-')
+        return 'W/"{}"'.format(hashlib.md5(':'.join(parts).encode()).hexdigest())
+
+    async def get(self):
+        page_fs_path = os.path.join(self.data_dir, self.riki_path)
+        page_suff = page_fs_path.rsplit('.', 1)[-1] if '.' in os.path.basename(page_fs_path) else None
+        if (not self.riki_path or files.page_is_dir(page_fs_path) or page_suff in appconf.RAW_FILES
+                or self.dir_metadata.directory_type != 'page'):
+            raise web.HTTPNotFound()
+
+        page_fs_path = f'{page_fs_path}.md'
+        include_list = self.url_arg('list') == '1'
+        etag = self.page_etag(page_fs_path, include_list)
+        if etag in self.request.headers.get('If-None-Match', ''):
+            raise web.HTTPNotModified(headers={'ETag': etag})
+
+        page_template, data = self.get_page_data(page_fs_path, include_list)
+        blocks = self._ctx.render_blocks(page_template, data, ('content', 'footer'))
+        return web.json_response(
+            dict(
+                html=blocks['content'],
+                footer=blocks['footer'],
+                page_info=asdict(data['page_info']),
+                path_elms=data['path_elms'],
+                page_name=data['page_name'],
+                page_list=data['page_list'] if include_list else None),
+            headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+
 @routes.view('/_images')
 class Images(Action):
     """
@@ -315,11 +595,9 @@ class Images(Action):
 
     """
     async def get(self):
-        images = files.list_files(self.data_dir, files.file_is_image, recursive=True)
-        extended = []
-        for img in images:
-            extended.append(files.get_file_info(img, path_prefix=self.data_dir))
-        return self.response_html('files.html', dict(files=extended))
+        images = files.iter_files(self.data_dir, files.file_is_image, recursive=True)
+        return await self.response_html_stream(
+            'files.html', dict(files=files.iter_file_info(images, path_prefix=self.data_dir)))
 
 
 @routes.view('/gallery/{path:.*}')
@@ -328,6 +606,59 @@ class Gallery(Action):
     async def get_num_files(self, path: str):
         return len(os.listdir(path)) - 1 # minus metadata.json which is required for a gallery page
 
+    def get_items(self, gallery_fs_dir: str, offset: int, limit: int) -> Tuple[List[files.FileInfo], int]:
+        """
+        Loads file information and picture metadata for a single page of gallery images.
+        Only the images within the requested page are opened.
+
+        arguments:
+        gallery_fs_dir -- a filesystem path of the gallery directory
+        offset -- index of the first image to be returned
+        limit -- max. number of images to be returned
+
+        returns:
+        a 2-tuple (list of file info objects, total number of images in the gallery)
+        """
+        import pictures
+        try:
+            images = files.list_files(gallery_fs_dir, files.file_is_image, recursive=False)
+        except FileNotFoundError:
+            raise web.HTTPNotFound()
+        extended: List[files.FileInfo] = []
+        sprite_url = '{}_sprite/{}'.format(
+            APP_PATH, urllib.parse.quote(os.path.relpath(gallery_fs_dir, self.data_dir)))
+        sheet_size = conf.gallery_page_size
+        sheet_keys = {}
+
+        for i, img in enumerate(images[offset:offset + limit], start=offset):
+            info = files.get_file_info(img, path_prefix=self.data_dir)
+            info.metadata = pictures.get_metadata(img)
+            sheet = i // sheet_size
+            if sheet not in sheet_keys:
+                sheet_keys[sheet] = pictures.get_sprite_sheet_key(
+                    images[sheet * sheet_size:(sheet + 1) * sheet_size])
+            info.sprite = pictures.SpriteInfo(
+                url=f'{sprite_url}?sheet={sheet}&v={sheet_keys[sheet]}',
+                x=0,
+                y=(i % sheet_size) * pictures.SPRITE_THUMB_SIZE[1],
+                width=pictures.SPRITE_THUMB_SIZE[0],
+                height=pictures.SPRITE_THUMB_SIZE[1])
+            extended.append(info)
+        return extended, len(images)
+
+    def get_gallery_dir(self) -> str:
+        """
+        Returns a filesystem path of the gallery directory specified
+        by the URL (with or without the trailing 'index'). For other
+        than gallery directories, HTTP 404 is raised.
+        """
+        gallery_fs_dir = os.path.join(self.data_dir, self.riki_path)
+        if os.path.basename(gallery_fs_dir) == 'index':
+            gallery_fs_dir = os.path.dirname(gallery_fs_dir)
+        if not files.page_is_dir(gallery_fs_dir) or self.dir_metadata.directory_type != 'gallery':
+            raise web.HTTPNotFound()
+        return gallery_fs_dir
+
     async def get(self):
         gallery_fs_dir = os.path.join(self.data_dir, self.riki_path)
         if files.page_is_dir(gallery_fs_dir):
@@ -344,18 +675,11 @@ class Gallery(Action):
         else:
             raise web.HTTPNotFound()
 
-        try:
-            images = files.list_files(gallery_fs_dir, files.file_is_image, recursive=False)
-        except FileNotFoundError:
-            raise web.HTTPNotFound()
-        extended: List[files.FileInfo] = []
-
-        for img in images:
-            info = files.get_file_info(img, path_prefix=self.data_dir)
-            info.metadata = pictures.get_metadata(img)
-            extended.append(info)
+        extended, total = self.get_items(gallery_fs_dir, 0, conf.gallery_page_size)
         values = dict(
             files=extended,
+            next_offset=len(extended) if len(extended) < total else None,
+            gallery_path=self.riki_path,
             page_list=[],
             path_elms=path_dir_elms(self.riki_path),
             curr_dir_name=self.get_current_dirname(self.riki_path),
@@ -364,29 +688,213 @@ class Gallery(Action):
         return self.response_html('gallery.html', values)
 
 
+@routes.view('/_gallery/{path:.*}')
+class GalleryItems(Gallery):
+    """
+    A paginated JSON list of gallery images (including picture metadata)
+
+    URL arguments:
+    offset -- index of the first image (default 0)
+    limit -- page size (default and max. value is conf.gallery_page_size)
+    """
+    async def get(self):
+        gallery_fs_dir = self.get_gallery_dir()
+        try:
+            offset = max(0, int(self.url_arg('offset') or 0))
+            limit = min(int(self.url_arg('limit') or conf.gallery_page_size), conf.gallery_page_size)
+        except ValueError:
+            raise web.HTTPBadRequest(reason='Invalid offset or limit')
+        if limit < 1:
+            raise web.HTTPBadRequest(reason='Invalid limit')
+        items, total = self.get_items(gallery_fs_dir, offset, limit)
+        next_offset = offset + len(items)
+        return web.json_response(dict(
+            items=[asdict(item) for item in items],
+            offset=offset,
+            total=total,
+            next_offset=next_offset if next_offset < total else None))
+
+
+@routes.view('/_sprite/{path:.*}')
+class Sprite(Gallery):
+    """
+    A sprite sheet with thumbnails of a single page of gallery images
+
+    URL arguments:
+    sheet -- a sheet number (i.e. a page of conf.gallery_page_size images)
+    v -- a sheet version (see pictures.get_sprite_sheet_key); if present,
+         the response can be cached by clients without revalidation
+    """
+    async def get(self):
+        import pictures
+        gallery_fs_dir = self.get_gallery_dir()
+        try:
+            sheet = int(self.url_arg('sheet') or 0)
+        except ValueError:
+            raise web.HTTPBadRequest(reason='Invalid sheet')
+        images = files.list_files(gallery_fs_dir, files.file_is_image, recursive=False)
+        sheet_images = images[sheet * conf.gallery_page_size:(sheet + 1) * conf.gallery_page_size]
+        if sheet < 0 or len(sheet_images) == 0:
+            raise web.HTTPNotFound()
+        sheet_path = await asyncio.get_running_loop().run_in_executor(
+            None, pictures.get_sprite_sheet, conf.picture_cache_dir, gallery_fs_dir, sheet, sheet_images)
+        resp = self.response_file(sheet_path)
+        if self.url_arg('v'):
+            resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return resp
+
+
 @routes.view('/_search')
 class Search(Action):
     """
     Search results page
     """
     async def get(self):
-        srch = search.FulltextSearcher(conf.search_index_dir, conf.data_dir)
+        import search
+        ram_index = self.request.app.get('search_index')
+        srch = search.FulltextSearcher(
+            conf.search_index_dir, conf.data_dir, ram_index.index if ram_index else None)
         rows = srch.search(self.url_arg('query'))
         values = dict(query=self.url_arg('query'), rows=rows)
         return self.response_html('search.html', values)
 
 
+@routes.view('/_broken_links')
+class BrokenLinks(Action):
+    """
+    A list of wiki-internal links pointing to non-existing pages
+    """
+    async def get(self):
+        link_graph = self._ctx.link_graph()
+        if link_graph is None:
+            raise web.HTTPNotFound()
+        return self.response_html('broken_links.html', dict(rows=link_graph.broken_links(self.data_dir)))
+
+
+@routes.view('/_refresh')
+class Refresh(BaseAction):
+    """
+    Reports changed files (e.g. from a Mercurial/Git hook) so all the related
+    caches and the search index can be updated without restarting the app.
+
+    The request must contain the 'Authorization: Bearer [refreshToken]' header.
+    The body is a JSON object {"paths": [...]} with paths relative to the data
+    directory. Missing or empty paths mean the whole data directory.
+    """
+    async def post(self):
+        if not conf.refresh_token:
+            raise web.HTTPNotFound()
+        auth = self.request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth.encode(), f'Bearer {conf.refresh_token}'.encode()):
+            raise web.HTTPUnauthorized()
+        try:
+            args = await self.request.json() if self.request.can_read_body else {}
+            paths = args.get('paths', [])
+        except (ValueError, AttributeError):
+            raise web.HTTPBadRequest(reason='Invalid request body')
+        if not isinstance(paths, list):
+            raise web.HTTPBadRequest(reason='Invalid paths')
+        paths = paths or ['']
+        notifier: watcher.ChangeNotifier = self.request.app['notifier']
+        if not all(isinstance(p, str) and notifier.normalize(p) for p in paths):
+            raise web.HTTPBadRequest(reason='Invalid path')
+        for path in paths:
+            notifier.publish(path)
+        return web.json_response(dict(num_paths=len(paths)))
+
+
 app = Application()
 app.add_routes(routes)
 
+async def run_prewarm():
+    try:
+        timings = await asyncio.get_running_loop().run_in_executor(None, prewarm)
+        logging.getLogger(__name__).info(
+            'pre-warmed deferred modules in {:.3f}s'.format(sum(t for _, t in timings)))
+    except Exception as ex:
+        logging.getLogger(__name__).error(f'Failed to pre-warm deferred modules: {ex}')
+
+def invalidate_sprite_sheets(fs_path: str):
+    if files.file_is_image(fs_path):
+        import pictures
+        pictures.remove_sprite_sheets(conf.picture_cache_dir, os.path.dirname(fs_path))
+
+async def reload_search_index(app):
+    while True:
+        await asyncio.sleep(conf.search_index_reload_interval)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, app['search_index'].reload)
+        except Exception as ex:
+            logging.getLogger(__name__).error(f'Failed to reload search index: {ex}')
+
 async def setup_runtime(app):
+    if conf is None:
+        init_conf(get_conf_path())
     app['helper'] = ActionHelper(conf, assets_url=None)  # TODO
+    app['notifier'] = watcher.ChangeNotifier(conf.data_dir)
+    app['notifier'].subscribe(app['helper'].invalidate)
+    app['notifier'].subscribe(invalidate_sprite_sheets)
+    app['reindex_queue'] = None
+    if conf.reindex_on_change and conf.search_index_dir:
+        import search
+        app['reindex_queue'] = search.ReindexQueue(conf.search_index_dir, conf.data_dir)
+        app['notifier'].subscribe(app['reindex_queue'].add)
+        app['reindex_queue'].start()
+    app['search_index'] = None
+    if conf.search_index_mode == 'ram' and conf.search_index_dir:
+        import search
+        app['search_index'] = search.RamIndex(conf.search_index_dir)
+        await asyncio.get_running_loop().run_in_executor(None, app['search_index'].reload)
+        app['search_index_reloader'] = asyncio.ensure_future(reload_search_index(app))
+    if conf.precompile_templates:
+        t0 = time.perf_counter()
+        num_templates = app['helper'].precompile_templates()
+        logging.getLogger(__name__).info(
+            'precompiled {} templates in {:.3f}s'.format(num_templates, time.perf_counter() - t0))
+    app['watcher'] = watcher.create_watcher(conf.watch_mode, app['notifier'], conf.watch_poll_interval)
+    if app['watcher']:
+        await app['watcher'].start()
+    if conf.prewarm:
+        # When started via 'python3 app.py', the listening socket is bound before
+        # the startup (see bind_socket()). Other ways of running the app (e.g. factory())
+        # bind the port only after the startup, so the task may run before that.
+        app['prewarm'] = asyncio.ensure_future(run_prewarm())
+
+async def cleanup_runtime(app):
+    if app['watcher']:
+        await app['watcher'].stop()
+    if app['reindex_queue']:
+        app['reindex_queue'].stop()
+    if app['search_index']:
+        app['search_index_reloader'].cancel()
 
 app.on_startup.append(setup_runtime)
+app.on_cleanup.append(cleanup_runtime)
+
+def bind_socket(port: int) -> socket.socket:
+    """
+    Creates a listening socket on all the interfaces (IPv4 and, if possible, IPv6).
+    """
+    if socket.has_dualstack_ipv6():
+        return socket.create_server(('', port), family=socket.AF_INET6, dualstack_ipv6=True)
+    return socket.create_server(('', port))
 
 async def factory():
+    if conf is None:
+        init_conf(get_conf_path())
     return app
 
 if __name__ == '__main__':
-    app.update(asdict(conf))
-    run_app(app, port='8080')
+    argparser = argparse.ArgumentParser(description='Riki')
+    argparser.add_argument(
+        '--startup-report', action='store_true', help='print a report of the application startup time and exit')
+    argparser.add_argument(
+        '--limit', type=int, default=15, help='max. number of listed imports in the startup report')
+    args = argparser.parse_args()
+    if args.startup_report:
+        import startup
+        startup.print_report(get_conf_path(), args.limit)
+    else:
+        init_conf(get_conf_path())
+        app.update(asdict(conf))
+        run_app(app, sock=bind_socket(8080))
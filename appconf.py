@@ -12,12 +12,25 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-from dataclasses import dataclass, field
-from dataclasses_json import dataclass_json, LetterCase
+import re
+import json
+from dataclasses import dataclass, field, fields
 from typing import List, Optional
 
 
-@dataclass_json(letter_case=LetterCase.CAMEL)
+def from_camel_case_dict(cls, data: dict):
+    """
+    Creates a dataclass instance from a dictionary with camelCase
+    keys (e.g. 'dataDir' for data_dir). Unknown keys are ignored.
+    """
+    args = {}
+    for fld in fields(cls):
+        key = re.sub(r'_([a-z0-9])', lambda m: m.group(1).upper(), fld.name)
+        if key in data:
+            args[fld.name] = data[key]
+    return cls(**args)
+
+
 @dataclass
 class Conf:
     app_path: str
@@ -27,14 +40,24 @@ class Conf:
     picture_cache_dir: str
     hg_info_encoding: str
     search_index_dir: Optional[str] = None
+    search_index_mode: str = 'disk'
+    search_index_reload_interval: float = 5.0
     markdown_extensions: List[str] = field(default_factory=lambda: [])
     emoji_cdn_url: Optional[str] = None
+    gallery_page_size: int = 50
+    watch_mode: Optional[str] = None
+    watch_poll_interval: float = 5.0
+    refresh_token: Optional[str] = None
+    reindex_on_change: bool = False
+    prewarm: bool = True
+    precompile_templates: bool = False
+    fragment_cache_size: int = 2000
     app_name: str = field(default='Riki')
 
 
 def load_conf(path: str) -> Conf:
     with open(path) as fr:
-        return Conf.from_json(fr.read())
+        return from_camel_case_dict(Conf, json.load(fr))
 
 
 ROUTES = (
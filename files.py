@@ -15,7 +15,7 @@
 import os
 import logging
 import re
-from typing import List, Any, Optional
+from typing import Iterable, Iterator, List, Any, Optional
 import datetime
 from dataclasses import dataclass
 
@@ -26,6 +26,7 @@ class FileInfo:
     mtime: int
     relpath: str
     metadata: Optional[Any] = None
+    sprite: Optional[Any] = None
 
 
 @dataclass
@@ -110,36 +111,65 @@ def get_file_info(path, path_prefix='') -> FileInfo:
         relpath=path[len(path_prefix):] if path.find(path_prefix) == 0 else path)
 
 
-def list_files(path, predicate=None, recursive=False, include_dirs=False) -> List[str]:
+def iter_file_info(paths: Iterable[str], path_prefix='') -> Iterator[FileInfo]:
     """
-    Lists files (non-recursively) at the specified path.
+    A lazy variant of get_file_info() applied to a sequence of paths.
+    Files are stat-ed only once the respective item is requested.
 
     arguments:
-    path -- path of a directory where the searching starts
-    pattern -- optional regex pattern file names must satisfy to be included
+    paths -- an iterable of file paths
+    path_prefix -- a path prefix we want to remove
 
     returns:
-    list of absolute file paths
+    an iterator of FileInfo objects
     """
-    ans = []
+    for path in paths:
+        yield get_file_info(path, path_prefix=path_prefix)
 
-    def sort_key(p1):
-        return int(os.path.isdir(os.path.join(path, p1)))
 
-    for item in sorted(os.listdir(path), key=sort_key):
+def iter_files(path, predicate=None, recursive=False, include_dirs=False) -> Iterator[str]:
+    """
+    Iterates over files at the specified path. Unlike list_files(), items
+    are produced one by one (each directory is sorted by item name) so
+    it is not necessary to traverse the whole tree before the first
+    item is available.
+
+    arguments:
+    path -- path of a directory where the searching starts
+    predicate -- optional function a file name must satisfy to be included
+    recursive -- if True then subdirectories are searched too
+    include_dirs -- if True then directories are included in the output
+
+    returns:
+    an iterator of absolute file paths
+    """
+    for item in sorted(os.listdir(path)):
         if item.startswith('.'):
             continue
         abspath = '%s/%s' % (path, item)
         if os.path.isdir(abspath):
             if include_dirs:
-                ans.append(abspath)
+                yield abspath
             if recursive:
-                ans += list_files(abspath, predicate, recursive)
+                yield from iter_files(abspath, predicate, recursive)
         elif not os.path.isfile(abspath) or (callable(predicate) and not predicate(item)):
             continue
         else:
-            ans.append(abspath)
-    return sorted(ans)
+            yield abspath
+
+
+def list_files(path, predicate=None, recursive=False, include_dirs=False) -> List[str]:
+    """
+    Lists files (non-recursively) at the specified path.
+
+    arguments:
+    path -- path of a directory where the searching starts
+    pattern -- optional regex pattern file names must satisfy to be included
+
+    returns:
+    list of absolute file paths
+    """
+    return sorted(iter_files(path, predicate, recursive, include_dirs))
 
 
 def get_version_info(repo_path: str, path: str, info_encoding: str) -> RevisionInfo:
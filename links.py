@@ -0,0 +1,177 @@
+# Copyright 2021 Tomas Machalek <tomas.machalek@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+A graph of wiki-internal links between pages.
+
+Pages are identified the same way as in URLs - i.e. by a path relative
+to the data directory without the .md suffix (e.g. 'foo/bar'). The graph
+is updated along with the search index (see search.FulltextWriter) and
+stored as a gzipped JSON file next to the index.
+"""
+
+import os
+import re
+import gzip
+import json
+import posixpath
+import urllib.parse
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+LINK_GRAPH_FILE = 'riki-links.json.gz'
+
+_ABS_PAGE_URL = re.compile(r'^/(?:[^/]+/)*?page(/.*)?$')
+
+
+def page_id(rel_path: str) -> str:
+    """
+    Converts a data-dir-relative path of a Markdown file into a page identifier
+    """
+    rel_path = rel_path.strip('/')
+    return rel_path[:-3] if rel_path.endswith('.md') else rel_path
+
+
+def resolve_link(source: str, href: str) -> Optional[str]:
+    """
+    Resolves a link found on a page into a target page identifier.
+
+    arguments:
+    source -- identifier of the page containing the link
+    href -- the link as written in the page
+
+    returns:
+    a page identifier or None if the link is not a wiki-internal one
+    """
+    href = urllib.parse.unquote(href.split('#', 1)[0].split('?', 1)[0].strip())
+    if not href or re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', href) or href.startswith('//'):
+        return None
+    if href.startswith('/'):
+        srch = _ABS_PAGE_URL.match(href)
+        if not srch:
+            return None
+        target = (srch.group(1) or '/index').lstrip('/')
+    else:
+        target = posixpath.join(posixpath.dirname(source), href)
+    if target.endswith('/') or target == '':
+        target = posixpath.join(target, 'index')
+    target = posixpath.normpath(target)
+    if target.startswith('..') or target == '.':
+        return None
+    return page_id(target)
+
+
+class LinkGraph:
+
+    _path: Optional[str]
+
+    _outgoing: Dict[str, List[str]]
+
+    _incoming: Optional[Dict[str, Set[str]]]
+
+    _mtime: Optional[int]
+
+    def __init__(self, path: Optional[str] = None):
+        self._path = path
+        self._outgoing = {}
+        self._incoming = None
+        self._mtime = None
+
+    @staticmethod
+    def graph_path(index_dir: str) -> str:
+        return os.path.join(index_dir, LINK_GRAPH_FILE)
+
+    def load(self) -> 'LinkGraph':
+        try:
+            self._mtime = os.stat(self._path).st_mtime_ns
+            with gzip.open(self._path, 'rt', encoding='utf-8') as fr:
+                self._outgoing = json.load(fr)
+        except FileNotFoundError:
+            self._outgoing = {}
+        except (ValueError, OSError) as ex:
+            logging.getLogger(__name__).error(f'Failed to load link graph {self._path}: {ex}')
+            self._outgoing = {}
+        self._incoming = None
+        return self
+
+    def reload_if_changed(self) -> 'LinkGraph':
+        try:
+            if os.stat(self._path).st_mtime_ns != self._mtime:
+                self.load()
+        except FileNotFoundError:
+            pass
+        return self
+
+    @property
+    def mtime(self) -> Optional[int]:
+        return self._mtime
+
+    def save(self):
+        tmp_path = f'{self._path}.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as fw:
+            json.dump(self._outgoing, fw, separators=(',', ':'))
+        os.replace(tmp_path, self._path)
+        self._mtime = os.stat(self._path).st_mtime_ns
+
+    def update(self, source: str, hrefs: Iterable[str]):
+        """
+        Sets outgoing links of a page (replacing the previous ones)
+
+        arguments:
+        source -- a page identifier
+        hrefs -- links as written in the page
+        """
+        targets = set(resolve_link(source, href) for href in hrefs)
+        targets.discard(None)
+        targets.discard(source)
+        self._outgoing[source] = sorted(targets)
+        self._incoming = None
+
+    def remove(self, source: str):
+        if self._outgoing.pop(source, None) is not None:
+            self._incoming = None
+
+    def _get_incoming(self) -> Dict[str, Set[str]]:
+        if self._incoming is None:
+            self._incoming = {}
+            for source, targets in self._outgoing.items():
+                for target in targets:
+                    self._incoming.setdefault(target, set()).add(source)
+        return self._incoming
+
+    def backlinks(self, target: str) -> List[str]:
+        """
+        Lists pages linking to the target page
+        """
+        return sorted(self._get_incoming().get(target, ()))
+
+    def broken_links(self, data_dir: str) -> List[Tuple[str, str]]:
+        """
+        Lists links pointing to non-existing pages. Indexed pages are
+        resolved in memory; only other targets (directories, pictures,
+        deleted pages) are checked in the filesystem.
+
+        returns:
+        a list of (source page, target) pairs
+        """
+        ans = []
+        for target, sources in self._get_incoming().items():
+            if target in self._outgoing:
+                continue
+            fs_path = os.path.join(data_dir, target)
+            if (os.path.exists(fs_path) or os.path.isfile(f'{fs_path}.md')
+                    or posixpath.basename(target) == 'index' and os.path.isdir(os.path.dirname(fs_path))):
+                continue
+            ans.extend((source, target) for source in sources)
+        return sorted(ans)
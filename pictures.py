@@ -14,10 +14,12 @@
 
 import os
 from dataclasses import dataclass
-from PIL import Image
+from PIL import Image, ImageOps
 import PIL.ExifTags
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 import hashlib
+import glob
+import tempfile
 
 
 @dataclass
@@ -108,10 +110,105 @@ def get_resized_image(cache_dir: str, path: str, width: int, normalize: bool) ->
     size = (int(width), calc_size(img, width))
     thumb_path = get_thumbnail_path(cache_dir, path, size)
     if not os.path.isfile(thumb_path):
-        img.thumbnail(size, Image.ANTIALIAS)
+        img.thumbnail(size, Image.LANCZOS)
         if img.size[0] < img.size[1] and normalize:
             img = img.crop((0, 0, size[0], int(round(200. * 3 / 4))))
         if img.mode != 'RGB':
             img = img.convert('RGB')
         img.save(thumb_path, 'JPEG', quality=90)  # TODO
-    return thumb_path
\ No newline at end of file
+    return thumb_path
+
+
+SPRITE_THUMB_SIZE = (200, 150)
+
+
+@dataclass
+class SpriteInfo:
+    """
+    A position of a thumbnail within a sprite sheet
+    """
+    url: str
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+def _sprite_prefix(gallery_dir: str) -> str:
+    return 'sprite-{}-'.format(hashlib.md5(os.path.normpath(gallery_dir).encode()).hexdigest())
+
+
+def get_sprite_sheet_key(images: List[str]) -> str:
+    """
+    Calculates a key identifying a sprite sheet of the images.
+    Any change of the images (added/removed/modified files) produces
+    a different key.
+    """
+    hsh = hashlib.md5()
+    for path in images:
+        st = os.stat(path)
+        hsh.update(f'{path}:{st.st_mtime_ns}:{st.st_size};'.encode())
+    return hsh.hexdigest()
+
+
+def get_sprite_sheet_path(cache_dir: str, gallery_dir: str, sheet: int, key: str) -> str:
+    return os.path.join(cache_dir, f'{_sprite_prefix(gallery_dir)}{sheet}-{key}.jpg')
+
+
+def get_sprite_sheet(cache_dir: str, gallery_dir: str, sheet: int, images: List[str]) -> str:
+    """
+    Returns a path of a sprite sheet containing thumbnails of the images (each of them
+    cropped to SPRITE_THUMB_SIZE, stacked vertically in the order of the list).
+    The sheet is created if it is not cached yet.
+
+    arguments:
+    cache_dir -- a directory where the sheets are stored
+    gallery_dir -- a gallery directory the images belong to
+    sheet -- a number of the sheet within the gallery
+    images -- paths of the images
+
+    returns:
+    a path to the sprite sheet JPEG file
+    """
+    sheet_path = get_sprite_sheet_path(cache_dir, gallery_dir, sheet, get_sprite_sheet_key(images))
+    if not os.path.isfile(sheet_path):
+        w, h = SPRITE_THUMB_SIZE
+        sprite = Image.new('RGB', (w, h * max(1, len(images))), (255, 255, 255))
+        for i, path in enumerate(images):
+            with Image.open(path) as img:
+                img.draft('RGB', (w * 2, h * 2))  # faster JPEG decoding of large pictures
+                thumb = ImageOps.fit(img.convert('RGB'), SPRITE_THUMB_SIZE, Image.LANCZOS)
+                sprite.paste(thumb, (0, i * h))
+        # concurrent builders of the same sheet must not share a temporary file
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fw:
+                sprite.save(fw, 'JPEG', quality=85)
+            if os.path.isfile(sheet_path):  # someone else has been faster
+                os.unlink(tmp_path)
+            else:
+                os.replace(tmp_path, sheet_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        _remove_files(
+            glob.glob(os.path.join(cache_dir, f'{_sprite_prefix(gallery_dir)}{sheet}-*.jpg')), keep=sheet_path)
+    return sheet_path
+
+
+def _remove_files(paths: List[str], keep: Optional[str] = None):
+    for path in paths:
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def remove_sprite_sheets(cache_dir: str, gallery_dir: str):
+    """
+    Removes all the cached sprite sheets of a gallery directory
+    """
+    _remove_files(glob.glob(os.path.join(cache_dir, f'{_sprite_prefix(gallery_dir)}*.jpg')))
@@ -12,15 +12,23 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
-from nis import match
 from whoosh.fields import Schema, TEXT, KEYWORD, ID
 from whoosh.analysis import StemmingAnalyzer
 from whoosh import index, writing, highlight
+from whoosh.index import LockError
 from whoosh.qparser import MultifieldParser
-from bs4 import BeautifulSoup
-from markdown import markdown
+from whoosh.filedb.filestore import FileStorage, copy_to_ram
 import os
-from appconf import Conf
+import re
+import html
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Set
+from appconf import Conf, load_conf
+import files
+import links
 import argparse
 
 """
@@ -36,13 +44,19 @@ class Fulltext:
 
     _index: index.FileIndex
 
-    def __init__(self, index_path: str):
+    def __init__(self, index_path: str, ix: Optional[index.Index] = None):
+        """
+        arguments:
+        index_path -- a directory containing the index
+        ix -- an already opened index (e.g. RamIndex.index); if None then the index
+              at index_path is opened (or created)
+        """
         self._index_path = index_path
-        self._schema = Schema(
-            path=ID(stored=True),
-            body=TEXT(analyzer=StemmingAnalyzer()),
-            tags=KEYWORD)
-        self._open_index()
+        self._schema = create_schema()
+        if ix is None:
+            self._open_index()
+        else:
+            self._index = ix
 
     def _open_index(self):
         if not index.exists_in(self._index_path):
@@ -51,16 +65,70 @@ class Fulltext:
             self._index = index.open_dir(self._index_path, schema=self._schema)
 
 
+def create_schema() -> Schema:
+    return Schema(
+        path=ID(stored=True),
+        title=TEXT(analyzer=StemmingAnalyzer(), field_boost=3.0),
+        headings=TEXT(analyzer=StemmingAnalyzer(), field_boost=2.0),
+        body=TEXT(analyzer=StemmingAnalyzer()),
+        tags=KEYWORD)
+
+
+class RamIndex:
+    """
+    An in-memory copy of a committed index. Once the on-disk generation
+    changes, reload() loads a new copy and swaps it with the current one
+    so searching never touches the disk.
+    """
+
+    _index_path: str
+
+    _disk_index: Optional[index.FileIndex]
+
+    _index: Optional[index.FileIndex]
+
+    _generation: Optional[int]
+
+    def __init__(self, index_path: str):
+        self._index_path = index_path
+        self._disk_index = None
+        self._index = None
+        self._generation = None
+
+    @property
+    def index(self) -> Optional[index.FileIndex]:
+        return self._index
+
+    def reload(self) -> bool:
+        """
+        Loads a new in-memory copy of the index if the on-disk generation
+        has changed (checking the generation requires just a directory listing).
+
+        returns:
+        True if a new copy has been loaded else False
+        """
+        if self._disk_index is None:
+            self._disk_index = Fulltext(self._index_path)._index
+        if self._disk_index.latest_generation() == self._generation:
+            return False
+        ram_index = copy_to_ram(FileStorage(self._index_path)).open_index(schema=create_schema())
+        self._index = ram_index  # searchers opened from the previous copy keep working
+        self._generation = ram_index.latest_generation()
+        logging.getLogger(__name__).info(
+            f'Loaded search index generation {self._generation} into memory')
+        return True
+
+
 class FulltextSearcher(Fulltext):
 
     _data_dir: str
 
-    def __init__(self, index_path: str, data_dir: str):
-        super().__init__(index_path)
+    def __init__(self, index_path: str, data_dir: str, ix: Optional[index.Index] = None):
+        super().__init__(index_path, ix)
         self._data_dir = data_dir
 
     def search(self, q: str):
-        qp = MultifieldParser(['body', 'tags'], schema=self._schema)
+        qp = MultifieldParser(['title', 'headings', 'body', 'tags'], schema=self._schema)
         q_obj = qp.parse(q)
         ans = []
         with self._index.searcher() as srch:
@@ -81,40 +149,230 @@ class FulltextSearcher(Fulltext):
         return ans
 
 
+@dataclass
+class MarkdownDocument:
+    text: str
+    title: Optional[str] = None
+    headings: List[str] = field(default_factory=list)
+    links: List[str] = field(default_factory=list)
+
+
+_md_local = threading.local()
+
+
+def _get_md_processor():
+    if not hasattr(_md_local, 'processor'):
+        from markdown import Markdown
+        _md_local.processor = Markdown()
+    return _md_local.processor
+
+
+_HEADINGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+
+def _collect_text(md, elm, out: List[str]):
+    block = md.is_block_level(elm.tag)
+    if block:
+        out.append(' ')
+    if elm.text:
+        out.append(elm.text)
+    for child in elm:
+        _collect_text(md, child, out)
+        if child.tail:
+            out.append(child.tail)
+    if block:
+        out.append(' ')
+
+
+def parse_md(md_text: str) -> MarkdownDocument:
+    """
+    Extracts text, title, headings and links from a Markdown document.
+    Unlike markdown.markdown(), this stops once the element tree is
+    built - i.e. there is no HTML serialization and re-parsing involved.
+
+    returns:
+    a MarkdownDocument instance
+    """
+    from markdown.util import HTML_PLACEHOLDER_RE
+    md = _get_md_processor()
+    md.reset()
+    lines = md_text.split('\n')
+    for prep in md.preprocessors:
+        lines = prep.run(lines)
+    root = md.parser.parseDocument(lines).getroot()
+    for treeprocessor in md.treeprocessors:
+        new_root = treeprocessor.run(root)
+        if new_root is not None:
+            root = new_root
+
+    def expand_raw_html(text: str) -> str:
+        # raw HTML is stashed by the parser; we want just its text
+        # (entities and escaped code are decoded afterwards via html.unescape)
+        return HTML_PLACEHOLDER_RE.sub(
+            lambda m: re.sub(r'<[^>]*>', ' ', str(md.htmlStash.rawHtmlBlocks[int(m.group(1))])), text)
+
+    doc = MarkdownDocument(text='')
+    for elm in root.iter():
+        if elm.tag in _HEADINGS:
+            heading = ' '.join(html.unescape(expand_raw_html(''.join(elm.itertext()))).split())
+            doc.headings.append(heading)
+            if doc.title is None and elm.tag == 'h1':
+                doc.title = heading
+        elif elm.tag == 'a' and elm.get('href'):
+            doc.links.append(elm.get('href'))
+    text = []
+    _collect_text(md, root, text)
+    doc.text = ' '.join(html.unescape(expand_raw_html(''.join(text))).split())
+    return doc
+
+
 def extract_text_from_md(md_text: str) -> str:
-    return ' '.join(BeautifulSoup(markdown(md_text), features='lxml').findAll(text=True))
+    return parse_md(md_text).text
 
 
 class FulltextWriter(Fulltext):
+    """
+    Search index writer. Along with the search index, the writer
+    also maintains the graph of links between pages (see links.LinkGraph).
+    """
 
     _writer: writing.IndexWriter
 
+    _link_graph: links.LinkGraph
+
     def __enter__(self):
         self._writer = self._index.writer()
+        self._link_graph = links.LinkGraph(links.LinkGraph.graph_path(self._index_path)).load()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._writer.commit()
+        self._link_graph.save()
+
+    def reset_links(self):
+        self._link_graph = links.LinkGraph(links.LinkGraph.graph_path(self._index_path))
 
     def add_document(self, path: str, md_text: str):
-        text = extract_text_from_md(md_text)
+        doc = parse_md(md_text)
         tags = ' '.join(x for x in path.rsplit('.', 1)[0].split('/') if x not in ('index', ''))
-        self._writer.add_document(path=path, body=text, tags=tags)
+        self._writer.add_document(
+            path=path, title=doc.title or '', headings=' '.join(doc.headings), body=doc.text, tags=tags)
+        if files.file_is_page(path):
+            self._link_graph.update(links.page_id(path), doc.links)
+
+    def remove_document(self, path: str):
+        self._writer.delete_by_term('path', path)
+        if files.file_is_page(path):
+            self._link_graph.remove(links.page_id(path))
+
+    def update_document(self, path: str, md_text: str):
+        self.remove_document(path)
+        self.add_document(path, md_text)
 
 
 def _is_text_file(fpath: str) -> bool:
     return fpath.endswith('.md') or fpath.endswith('.txt')
 
 
-def index_recursive(data_root: str, rel_path: str, fulltext: FulltextWriter):
+def index_recursive(data_root: str, rel_path: str, fulltext: FulltextWriter, update: bool = False):
     full_path = os.path.join(data_root, rel_path)
     for item in os.listdir(full_path):
         file_path = os.path.join(data_root, rel_path, item)
         if os.path.isfile(file_path) and _is_text_file(file_path):
             with open(file_path) as fr:
-                fulltext.add_document(os.path.join(rel_path, item), fr.read())
+                if update:
+                    fulltext.update_document(os.path.join(rel_path, item), fr.read())
+                else:
+                    fulltext.add_document(os.path.join(rel_path, item), fr.read())
         elif os.path.isdir(file_path):
-            index_recursive(data_root, os.path.join(rel_path, item), fulltext)
+            index_recursive(data_root, os.path.join(rel_path, item), fulltext, update)
+
+
+def index_files(data_root: str, rel_paths: Iterable[str], fulltext: FulltextWriter):
+    """
+    Updates index entries of the specified files. Files which do not exist
+    anymore are removed from the index. Directories are indexed recursively.
+
+    arguments:
+    data_root -- the data directory
+    rel_paths -- paths relative to the data directory
+    fulltext -- an opened index writer
+    """
+    for rel_path in rel_paths:
+        rel_path = rel_path.strip('/')
+        file_path = os.path.join(data_root, rel_path)
+        if os.path.isdir(file_path):
+            index_recursive(data_root, rel_path, fulltext, update=True)
+        elif _is_text_file(file_path):
+            if os.path.isfile(file_path):
+                with open(file_path) as fr:
+                    fulltext.update_document(rel_path, fr.read())
+            else:
+                fulltext.remove_document(rel_path)
+
+
+class ReindexQueue:
+    """
+    Collects changed files (see watcher.ChangeNotifier) and updates
+    the search index in batches in a background thread.
+    """
+
+    _index_path: str
+
+    _data_dir: str
+
+    _delay: float
+
+    _pending: Set[str]
+
+    _event: Optional[asyncio.Event]
+
+    _task: Optional[asyncio.Task]
+
+    def __init__(self, index_path: str, data_dir: str, delay: float = 2.0):
+        self._index_path = index_path
+        self._data_dir = os.path.normpath(data_dir)
+        self._delay = delay
+        self._pending = set()
+        self._event = None
+        self._task = None
+
+    def add(self, fs_path: str):
+        name = os.path.basename(fs_path)
+        if os.path.isdir(fs_path) or _is_text_file(name):
+            self._pending.add(os.path.relpath(fs_path, self._data_dir) if fs_path != self._data_dir else '')
+            if self._event:
+                self._event.set()
+
+    def _update(self, rel_paths: List[str]):
+        with FulltextWriter(self._index_path) as fw:
+            index_files(self._data_dir, rel_paths, fw)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._event.wait()
+            await asyncio.sleep(self._delay)  # let the changes settle down
+            self._event.clear()
+            rel_paths = sorted(self._pending)
+            self._pending = set()
+            try:
+                await loop.run_in_executor(None, self._update, rel_paths)
+                logging.getLogger(__name__).info(f'Reindexed {len(rel_paths)} path(s)')
+            except LockError:
+                self._pending.update(rel_paths)
+                self._event.set()
+            except Exception as ex:
+                logging.getLogger(__name__).error(f'Failed to reindex changed files: {ex}')
+
+    def start(self):
+        self._event = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
 
 
 # TODO do we need this?
@@ -125,6 +383,7 @@ def extract_description(html: str):
     arguments:
     md_path -- path to a markdown file to be analyzed
     """
+    from bs4 import BeautifulSoup
     soup = BeautifulSoup.BeautifulSoup(html)
     h1 = soup.find('h1')
     if h1:
@@ -140,15 +399,18 @@ if __name__ == '__main__':
         conf_path = os.environ['RIKI_CONF_PATH']
     else:
         conf_path = os.path.realpath(os.path.join(os.path.dirname(__file__), 'config.json'))
-    with open(conf_path) as fr:
-        conf: Conf = Conf.from_json(fr.read())
+    conf: Conf = load_conf(conf_path)
     argparser = argparse.ArgumentParser(description="Markdown file indexer")
     argparser.add_argument(
-        '-f', '--file', help="a single file to index")
+        '-f', '--file', help="a single file or directory (relative to the data directory) to reindex")
     argparser.add_argument(
         '-x', '--index-dir', type=str, help="custom index directory")
     argparser.add_argument(
         '-d', '--data-dir', help="custom text data location")
     args = argparser.parse_args()
     with FulltextWriter(args.index_dir if args.index_dir else conf.search_index_dir) as fw:
-        index_recursive(args.data_dir if args.data_dir else conf.data_dir, '', fw)
+        if args.file:
+            index_files(args.data_dir if args.data_dir else conf.data_dir, [args.file], fw)
+        else:
+            fw.reset_links()
+            index_recursive(args.data_dir if args.data_dir else conf.data_dir, '', fw)
@@ -0,0 +1,97 @@
+# Copyright 2021 Tomas Machalek <tomas.machalek@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Application startup time report (python3 app.py --startup-report).
+
+The report has three parts:
+1) imports performed by 'import app' (measured via 'python -X importtime' in a subprocess
+   so the numbers are not affected by modules already loaded),
+2) the application initialization steps required before the port is bound,
+3) the deferred steps performed in background once the server is running.
+"""
+
+import os
+import re
+import sys
+import time
+import subprocess
+from typing import List, Tuple
+
+_IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)$')
+
+
+def measure_imports(module: str, conf_path: str) -> Tuple[int, List[Tuple[str, int]]]:
+    """
+    Measures import of a module in a fresh interpreter.
+
+    arguments:
+    module -- a module name
+    conf_path -- a Riki configuration file passed to the subprocess
+
+    returns:
+    a 2-tuple (total time in us, list of (directly imported module, cumulative time in us))
+    """
+    env = dict(os.environ, RIKI_CONF_PATH=conf_path)
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.realpath(__file__)), env=env, stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE, check=True)
+    total = 0
+    children = []
+    # importtime lists children before their parent; depth is encoded by indentation
+    for line in proc.stderr.decode().splitlines():
+        srch = _IMPORT_TIME_LINE.match(line)
+        if not srch:
+            continue
+        depth = (len(srch.group(3)) - 1) // 2
+        if depth == 1:
+            children.append((srch.group(4), int(srch.group(2))))
+        elif depth == 0:
+            if srch.group(4) == module:
+                total = int(srch.group(2))
+                break
+            children = []
+    return total, sorted(children, key=lambda x: x[1], reverse=True)
+
+
+def _print_row(label: str, seconds: float):
+    print(f'  {label:<50} {seconds * 1000:>10.1f} ms')
+
+
+def print_report(conf_path: str, limit: int):
+    total, children = measure_imports('app', conf_path)
+    print('Imports (import app):')
+    for name, cumul in children[:limit]:
+        _print_row(name, cumul / 1e6)
+    _print_row('TOTAL', total / 1e6)
+
+    print('\nInitialization (before the port is bound):')
+    import app
+    t0 = time.perf_counter()
+    app.init_conf(conf_path)
+    _print_row('configuration and logging', time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    helper = app.ActionHelper(app.conf, assets_url=None)
+    _print_row('action helper', time.perf_counter() - t0)
+    if app.conf.precompile_templates:
+        t0 = time.perf_counter()
+        helper.precompile_templates()
+        _print_row('template precompilation', time.perf_counter() - t0)
+
+    print('\nDeferred (pre-warmed in background):')
+    timings = app.prewarm()
+    for label, seconds in timings:
+        _print_row(label, seconds)
+    _print_row('TOTAL', sum(t for _, t in timings))
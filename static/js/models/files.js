@@ -14,11 +14,81 @@
  * limitations under the License.
  */
 
-define(['jquery', 'fancybox', 'models/layout'], function ($, fancybox, layout) {
+define(['jquery', 'win', 'fancybox', 'models/layout'], function ($, win, fancybox, layout) {
     'use strict';
 
     var lib = {};
 
+    function escapeHtml(s) {
+        return $('<div />').text(s === null || s === undefined ? '' : String(s)).html();
+    }
+
+    function createGalleryItem(appPath, item, idx) {
+        var meta = item.metadata || {},
+            dl = [];
+
+        dl.push('<dt>size</dt><dd>' + escapeHtml(meta.image_width) + ' x ' + escapeHtml(meta.image_height));
+        if (meta.orientation) {
+            dl.push(' ' + escapeHtml(meta.orientation));
+        }
+        dl.push('</dd>');
+        if (meta.camera) {
+            dl.push('<dt>camera</dt><dd>' + escapeHtml(meta.camera) + '</dd>');
+        }
+        if (meta.datetime) {
+            dl.push('<dt>date and time</dt><dd>' + escapeHtml(meta.datetime) + '</dd>');
+        }
+        return $(
+            '<div class="gallery-item" style="width: 200px">' +
+            '<a class="fancybox" rel="group" href="' + appPath + 'page' + encodeURI(item.relpath) + '?width=800">' +
+            '<span class="sprite" style="background-image: url(\'' + item.sprite.url + '\'); ' +
+            'background-position: -' + item.sprite.x + 'px -' + item.sprite.y + 'px; ' +
+            'width: ' + item.sprite.width + 'px; height: ' + item.sprite.height + 'px"></span></a>' +
+            '<div class="pic-metadata info-' + idx + '"><dl>' + dl.join('') + '</dl></div>' +
+            '<div class="metadata"><div class="dt">' + (meta.datetime ? escapeHtml(meta.datetime) : '-') + '</div>' +
+            '<a class="expand-info" data-expand-item="' + idx + '">info</a></div>' +
+            '</div>'
+        );
+    }
+
+    /**
+     * Loads next pages of gallery items (see the GalleryItems action)
+     * once the user scrolls near the bottom of the grid.
+     */
+    lib.initGallery = function (appPath) {
+        var grid = $('.pic-grid'),
+            nextOffset = grid.data('next-offset'),
+            loading = false;
+
+        grid.on('click', 'a.expand-info', function () {
+            $('.pic-metadata.info-' + $(this).data('expand-item')).toggle();
+        });
+
+        function loadNext() {
+            if (loading || nextOffset === undefined || nextOffset === null ||
+                    $(win).scrollTop() + $(win).height() < grid.offset().top + grid.height() - 400) {
+                return;
+            }
+            loading = true;
+            $.getJSON(grid.data('items-url'), {offset: nextOffset}).done(function (data) {
+                var newItems = $.map(data.items, function (item, i) {
+                    return createGalleryItem(appPath, item, data.offset + i + 1).get(0);
+                });
+                grid.append(newItems);
+                $(newItems).find('.fancybox').fancybox();
+                nextOffset = data.next_offset;
+                loading = false;
+                loadNext();
+
+            }).fail(function () {
+                loading = false;
+            });
+        }
+
+        $(win).on('scroll resize', loadNext);
+        loadNext();
+    };
+
     lib.init = function () {
         layout.init();
 
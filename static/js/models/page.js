@@ -41,8 +41,15 @@ define(['jquery', 'models/layout', 'katex'], function ($, layout, katex) {
         }
     }
 
-    lib.init = function () {
-        layout.init();
+    function escapeHtml(s) {
+        return $('<div />').text(s).html();
+    }
+
+    function dirname(path) {
+        return path.substring(0, path.lastIndexOf('/'));
+    }
+
+    function initContent() {
         $('section.main a').each(function () {
             if (isExternalLink(this)) {
                 $(this).addClass('external');
@@ -50,6 +57,97 @@ define(['jquery', 'models/layout', 'katex'], function ($, layout, katex) {
             }
         });
         applyKatex();
+    }
+
+    function renderPath(appPath, pathElms, pageName) {
+        const ans = ['<a class="home" href="' + appPath + 'page"><strong>&#x2302</strong></a> /'];
+        pathElms.forEach(function (item) {
+            ans.push('<a href="' + appPath + 'page/' + escapeHtml(item[1]) + '">' + escapeHtml(item[0]) + '</a> /');
+        });
+        ans.push(escapeHtml(pageName));
+        $('.contents .path').html(ans.join('\n'));
+    }
+
+    /**
+     * @param pageList a list of [full path, page name, is dir] items
+     */
+    function renderPageList(appPath, pageList, pageName) {
+        const menu = $('menu ul.page-list');
+        menu.empty();
+        pageList.forEach(function (item) {
+            const li = $('<li />'),
+                label = escapeHtml(item[1]) + (item[2] ? '/' : '');
+            li.attr({'data-path': item[0], 'data-name': item[1], 'data-dir': item[2] ? 1 : 0});
+            if (item[1] === pageName) {
+                li.html('<span class="page current">' + label + '</span>');
+
+            } else {
+                li.html('<a class="page" href="' + appPath + 'page' + escapeHtml(item[0]) + '">' + label + '</a>');
+            }
+            menu.append(li);
+        });
+    }
+
+    function currentPageList() {
+        return $('menu ul.page-list li').map(function () {
+            return [[$(this).attr('data-path'), $(this).attr('data-name'), $(this).attr('data-dir') === '1']];
+        }).get();
+    }
+
+    /**
+     * Replaces the current page with a different one using the partial-page
+     * JSON endpoint. The directory listing is requested only if the new page
+     * is located in a different directory. On any error, the browser
+     * falls back to a normal page load.
+     */
+    function loadPage(appPath, path, pushState) {
+        const withList = dirname(path) !== dirname(currentPath);
+        $.ajax({
+            url: appPath + '_page' + path,
+            data: withList ? {list: 1} : {},
+            dataType: 'json'
+
+        }).done(function (data) {
+            $('section.main').html(data.html);
+            $('.page-footer').html(data.footer);
+            renderPath(appPath, data.path_elms, data.page_name);
+            renderPageList(appPath, withList ? data.page_list : currentPageList(), data.page_name);
+            currentPath = path;
+            if (pushState) {
+                history.pushState({path: path}, '', appPath + 'page' + path);
+                window.scrollTo(0, 0);
+            }
+            initContent();
+
+        }).fail(function () {
+            window.location.href = appPath + 'page' + path;
+        });
+    }
+
+    var currentPath;
+
+    lib.init = function (appPath) {
+        layout.init();
+        initContent();
+        if (appPath === undefined || !window.history || !history.pushState) {
+            return;
+        }
+        currentPath = window.location.pathname.substring((appPath + 'page').length);
+        history.replaceState({path: currentPath}, '', window.location.href);
+        $('menu').on('click', 'ul.page-list a.page', function (evt) {
+            const li = $(this).closest('li');
+            if (li.attr('data-dir') === '1' || evt.ctrlKey || evt.metaKey || evt.shiftKey) {
+                return;
+            }
+            evt.preventDefault();
+            loadPage(appPath, li.attr('data-path'), true);
+        });
+        $(window).on('popstate', function (evt) {
+            const state = evt.originalEvent.state;
+            if (state && state.path) {
+                loadPage(appPath, state.path, false);
+            }
+        });
     };
 
     return lib;
@@ -0,0 +1,287 @@
+# Copyright 2021 Tomas Machalek <tomas.machalek@gmail.com>
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+Data directory change notifications.
+
+All the changes (no matter whether detected by a watcher or reported
+via the /_refresh action) are published via ChangeNotifier as normalized
+absolute filesystem paths. Caches and other interested components
+subscribe to the notifier and invalidate whatever depends on the path.
+A path of a directory means that anything below the directory may have
+changed.
+"""
+
+import os
+import sys
+import struct
+import asyncio
+import logging
+import ctypes
+import ctypes.util
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class ChangeNotifier:
+
+    _data_dir: str
+
+    _subscribers: List[Callable[[str], None]]
+
+    def __init__(self, data_dir: str):
+        self._data_dir = os.path.normpath(data_dir)
+        self._subscribers = []
+
+    @property
+    def data_dir(self) -> str:
+        return self._data_dir
+
+    def subscribe(self, fn: Callable[[str], None]):
+        self._subscribers.append(fn)
+
+    def normalize(self, path: str) -> Optional[str]:
+        """
+        Converts a path (absolute or relative to the data directory)
+        into a normalized absolute path. Paths outside the data
+        directory are refused.
+
+        returns:
+        a normalized path or None if the path is outside the data dir
+        """
+        ans = os.path.normpath(os.path.join(self._data_dir, path))
+        if ans == self._data_dir or ans.startswith(self._data_dir + os.sep):
+            return ans
+        return None
+
+    def publish(self, path: str):
+        norm_path = self.normalize(path)
+        if norm_path is None:
+            logging.getLogger(__name__).warning(f'Ignoring change outside data dir: {path}')
+            return
+        for fn in self._subscribers:
+            try:
+                fn(norm_path)
+            except Exception as ex:
+                logging.getLogger(__name__).error(f'Failed to process change of {norm_path}: {ex}')
+
+
+def is_ignored(name: str) -> bool:
+    """
+    Hidden files and directories (including .hg and .git) are never watched
+    """
+    return name.startswith('.')
+
+
+class PollingWatcher:
+    """
+    A portable watcher which periodically compares mtimes of all the files
+    and directories within the data directory.
+    """
+
+    _notifier: ChangeNotifier
+
+    _interval: float
+
+    _snapshot: Dict[str, Tuple[int, bool]]
+
+    _task: Optional[asyncio.Task]
+
+    def __init__(self, notifier: ChangeNotifier, interval: float):
+        self._notifier = notifier
+        self._interval = interval
+        self._snapshot = {}
+        self._task = None
+
+    def _scan(self, path: str, ans: Dict[str, Tuple[int, bool]]):
+        try:
+            with os.scandir(path) as items:
+                for item in items:
+                    if is_ignored(item.name):
+                        continue
+                    try:
+                        is_dir = item.is_dir(follow_symlinks=False)
+                        ans[item.path] = (item.stat(follow_symlinks=False).st_mtime_ns, is_dir)
+                        if is_dir:
+                            self._scan(item.path, ans)
+                    except FileNotFoundError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def take_snapshot(self) -> Dict[str, Tuple[int, bool]]:
+        ans = {}
+        self._scan(self._notifier.data_dir, ans)
+        return ans
+
+    def publish_diff(self, curr: Dict[str, Tuple[int, bool]]):
+        """
+        Compares a snapshot of the data directory with the previous one
+        and publishes all the changed, added and removed paths. Modified
+        directories are skipped as their mtime changes just reflect
+        added/removed items which are published on their own.
+        """
+        changed = [
+            path for path, (mtime, is_dir) in curr.items()
+            if path not in self._snapshot or self._snapshot[path][0] != mtime and not is_dir]
+        changed += list(self._snapshot.keys() - curr.keys())
+        self._snapshot = curr
+        for path in changed:
+            self._notifier.publish(path)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                self.publish_diff(await loop.run_in_executor(None, self.take_snapshot))
+            except Exception as ex:
+                logging.getLogger(__name__).error(f'Data directory polling failed: {ex}')
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._snapshot = await loop.run_in_executor(None, self.take_snapshot)
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """
+    A Linux-only watcher based on inotify (accessed directly via libc so there
+    is no additional dependency). Each directory of the data directory
+    tree gets its own watch descriptor.
+    """
+
+    _notifier: ChangeNotifier
+
+    _libc: ctypes.CDLL
+
+    _fd: int
+
+    _watches: Dict[int, str]
+
+    def __init__(self, notifier: ChangeNotifier):
+        self._notifier = notifier
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = -1
+        self._watches = {}
+
+    @staticmethod
+    def is_available() -> bool:
+        if not sys.platform.startswith('linux'):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            return hasattr(libc, 'inotify_init1')
+        except OSError:
+            return False
+
+    def _add_watches(self, path: str):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            logging.getLogger(__name__).warning(f'Failed to watch {path}: {os.strerror(err)}')
+            return
+        self._watches[wd] = path
+        try:
+            with os.scandir(path) as items:
+                for item in items:
+                    if not is_ignored(item.name) and item.is_dir(follow_symlinks=False):
+                        self._add_watches(item.path)
+        except FileNotFoundError:
+            pass
+
+    def _on_readable(self):
+        try:
+            buff = os.read(self._fd, 1 << 16)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buff):
+            wd, mask, _, name_len = _EVENT_HEADER.unpack_from(buff, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(buff[offset:offset + name_len].rstrip(b'\0'))
+            offset += name_len
+            if mask & IN_Q_OVERFLOW:
+                self._notifier.publish(self._notifier.data_dir)
+                continue
+            dir_path = self._watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & IN_IGNORED:
+                del self._watches[wd]
+                continue
+            if name and is_ignored(name):
+                continue
+            path = os.path.join(dir_path, name) if name else dir_path
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_watches(path)
+            self._notifier.publish(path)
+
+    async def start(self):
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        await asyncio.get_running_loop().run_in_executor(None, self._add_watches, self._notifier.data_dir)
+        asyncio.get_running_loop().add_reader(self._fd, self._on_readable)
+
+    async def stop(self):
+        if self._fd >= 0:
+            asyncio.get_running_loop().remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = -1
+            self._watches = {}
+
+
+def create_watcher(mode: Optional[str], notifier: ChangeNotifier, poll_interval: float):
+    """
+    Creates a watcher according to the configured mode.
+
+    arguments:
+    mode -- one of 'auto' (inotify if available, polling otherwise), 'inotify', 'poll'
+            or None (no watching; changes can be still reported via /_refresh)
+    notifier -- a notifier the watcher publishes to
+    poll_interval -- an interval (in seconds) of the polling watcher
+
+    returns:
+    a watcher instance or None
+    """
+    if mode is None:
+        return None
+    elif mode == 'inotify' or mode == 'auto' and InotifyWatcher.is_available():
+        return InotifyWatcher(notifier)
+    elif mode in ('auto', 'poll'):
+        return PollingWatcher(notifier, poll_interval)
+    raise ValueError(f'Unknown watch mode: {mode}')